@@ -0,0 +1,535 @@
+import discord
+from discord import Intents, Message, Embed
+from discord.ext import commands
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+from dotenv import load_dotenv
+from typing import Final, List, Dict, Optional, Callable, Awaitable, Iterable, Iterator
+import asyncio
+import httpx
+import logging
+import time
+import os
+import sys
+from io import BytesIO
+
+from conversation_mem import ConversationStorage
+from multimodal import process_file, shutdown_pdf_pool
+from rag import RagProcessor
+from semantic_cache import SemanticCache, context_key
+
+# Configure logging - only show INFO and above for most modules
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Keep discord.py at INFO level
+logger = logging.getLogger(__name__)
+
+# load environment variables
+load_dotenv()
+
+# Constants
+DISCORD_TOK: Final[str] = os.getenv('DISCORD_TOKEN')
+CLAUDE_KEY: Final[str] = os.getenv('ANTHROPIC_API_KEY')
+MODEL_NAME: Final[str] = "claude-3-5-sonnet-20241022"
+MAX_TOKENS: Final[int] = 4096
+TEMPERATURE: Final[float] = 0.1
+MAX_MEMORY: Final[int] = 20 
+EMBED_COLOR: Final[int] = 0xda7756
+DISCORD_LIMIT: Final[int] = 2000  # max characters per chunk we send to discord
+MAX_EMBEDS_PER_MSG: Final[int] = 10  # discord caps embeds per message...
+MAX_EMBED_CHARS_PER_MSG: Final[int] = 6000  # ...and their combined text
+MAX_CONCURRENT_REQUESTS: Final[int] = 4  # worker tasks, i.e. in-flight claude/rag requests
+REQUEST_QUEUE_SIZE: Final[int] = 64  # mentions waiting for a worker before we report busy
+STREAM_EDIT_INTERVAL: Final[float] = 1.0  # seconds between live edits, stays under discord's edit ratelimit
+
+# System prompt for normal mode (non-RAG) conversations
+SYSTEM_PROMPT: Final[str] = """
+You are a world-class expert in theoretical ML research, computational neuroscience, cognitive science,
+philosophy, and psychology with extensive experience in engineering complex ML systems end-to-end in 
+production. Respond with concise answers backed by rigorous mathematics, theory, and philosophical 
+reasoning. Make sure to double check your math, logic, and philosophical arguments for correctness 
+and consistency rigorously before answering.
+
+Your answers must be concise but detailed in technical specificity while avoiding any generic fluff.
+Note: For research paper analysis, use >rag command to enable RAG mode instead.
+""".strip()
+
+# system prompt as a prompt-cached content block, built once instead of on every request
+SYSTEM_BLOCKS: Final[List[Dict[str, any]]] = [
+    {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+]
+PROMPT_CACHING_HEADERS: Final[Dict[str, str]] = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+# test mode flag
+TEST_MODE: bool = False
+
+# initialize clients
+intents: Intents = Intents.default()
+intents.message_content = True
+bot = commands.Bot(command_prefix='>', intents=intents)
+# one long-lived HTTP/2 client so TCP/TLS connections to the API are reused across turns
+# and concurrent requests multiplex over the same connection
+claude_client: AsyncAnthropic = AsyncAnthropic(
+    api_key=CLAUDE_KEY,
+    http_client=DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=512, max_keepalive_connections=256, keepalive_expiry=60.0)
+    ),
+    # fail fast on connect, responses are streamed so 120s only bounds the gap between chunks
+    timeout=httpx.Timeout(120.0, connect=5.0),
+    max_retries=2
+)
+
+# initialize conversation storage and RAG processor
+storage = ConversationStorage(
+    "test_conversations.db" if TEST_MODE else "conversations.db",
+    max_history=MAX_MEMORY - 2
+)
+rag_processor = RagProcessor(storage)
+semantic_cache = SemanticCache()
+
+# track which users are in RAG mode
+rag_mode_users: set[int] = set()
+
+# background persistence tasks, referenced until done and awaited on shutdown
+pending_writes: set = set()
+
+# bounded buffer between on_message and the workers that call claude, so a burst of
+# mentions queues up (or is turned away) instead of flooding the API
+request_queue: asyncio.Queue = asyncio.Queue(maxsize=REQUEST_QUEUE_SIZE)
+request_workers: List[asyncio.Task] = []
+# indexes the local papers in the background so it doesn't hold up connecting
+rag_load_task: Optional[asyncio.Task] = None
+
+def _on_write_done(task: asyncio.Task) -> None:
+    pending_writes.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Failed to persist conversation: {task.exception()}")
+
+def _persist_turn(user_id: int, user_message: Dict[str, any], assistant_message: Dict[str, any]) -> None:
+    """Persist a user-assistant pair in the background so the reply isn't held up by the db commit"""
+    task = asyncio.create_task(storage.append_messages(user_id, [user_message, assistant_message]))
+    pending_writes.add(task)
+    task.add_done_callback(_on_write_done)
+
+# TEST_MODE is fixed at import, so pick the implementation once instead of checking the
+# flag on each of the calls per request
+if TEST_MODE:
+    def log_conversation_state(conversation: List[Dict[str, any]], stage: str) -> None:
+        """Debug helper to log conversation state at various stages"""
+        logger.debug(f"\n=== Conversation State at {stage} ===")
+        logger.debug(f"Length: {len(conversation)} messages")
+        for i, msg in enumerate(conversation):
+            logger.debug(f"Message {i}:")
+            logger.debug(f"  Role: {msg['role']}")
+            logger.debug(f"  Content: {msg['content']}")
+        logger.debug("=====================================\n")
+else:
+    def log_conversation_state(conversation: List[Dict[str, any]], stage: str) -> None:
+        pass
+
+async def get_claude_response(
+    user_id: int,
+    channel_id: int,
+    new_content: List[Dict[str, any]],
+    on_text: Optional[Callable[[str], Awaitable[None]]] = None
+) -> str:
+    """Handle normal mode (non-RAG) conversations, passing each streamed text delta to on_text"""
+    try:
+        # plain-text questions that closely match an earlier one asked in the same channel and
+        # context are answered from the semantic cache without calling Claude
+        query = new_content[0]['text'] if len(new_content) == 1 and new_content[0]['type'] == 'text' else None
+        embed_task = asyncio.create_task(semantic_cache.embed(query)) if query is not None else None
+        
+        # loading the history, embedding the query and fetching attachment references
+        # are independent, so they all run concurrently
+        refs = [item for item in new_content if item['type'] == 'image' and item['source']['type'] == 'attachment_ref']
+        conversation, *attachments = await asyncio.gather(
+            storage.get_convo(user_id),
+            *(storage.get_attachment_base64(item['source']['attachment_id']) for item in refs)
+        )
+        log_conversation_state(conversation, "Initial Load")
+        
+        for item, (media_type, data) in zip(refs, attachments):
+            item['source'] = {"type": "base64", "media_type": media_type, "data": data}
+        
+        context = context_key(channel_id, conversation)
+        query_embedding = await embed_task if embed_task is not None else None
+        if query_embedding is not None:
+            cached_response = semantic_cache.lookup(context, query_embedding)
+            if cached_response is not None:
+                logger.debug(f"Semantic cache hit for user {user_id}")
+                _persist_turn(
+                    user_id,
+                    {"role": "user", "content": new_content},
+                    {"role": "assistant", "content": [{"type": "text", "text": cached_response}]}
+                )
+                return cached_response
+        
+        # add the new content to the conversation with proper structure. storage only
+        # returns the last MAX_MEMORY - 2 messages, leaving room for the new pair
+        user_message = {"role": "user", "content": new_content}
+        conversation.append(user_message)
+        log_conversation_state(conversation, "After Adding User Message")
+    
+        # storage already hands back API-ready message dicts, so no per-message rebuild
+        # is needed. the shallow copy keeps the cache breakpoint below out of conversation
+        messages = list(conversation)
+        
+        # put a prompt-caching breakpoint on the last turn before the new message (the
+        # previous assistant reply) so the system prompt + prior history prefix is reused
+        # across calls. only the copy sent to the API is marked, the stored history stays
+        # untouched
+        if len(messages) > 1:
+            prefix_end = messages[-2]
+            blocks = list(prefix_end['content'])
+            blocks[-1] = {**blocks[-1], "cache_control": {"type": "ephemeral"}}
+            messages[-2] = {**prefix_end, "content": blocks}
+        
+        log_conversation_state(messages, "Before API Call")
+        
+        async with claude_client.messages.stream(
+            model=MODEL_NAME,
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURE,
+            system=SYSTEM_BLOCKS,
+            messages=messages,
+            extra_headers=PROMPT_CACHING_HEADERS
+        ) as stream:
+            async for text in stream.text_stream:
+                if on_text is not None:
+                    await on_text(text)
+            msg = await stream.get_final_message()
+        
+        assistant_response: str = msg.content[0].text
+        
+        # confirm the prompt cache breakpoints are hitting
+        logger.debug(
+            f"Prompt cache for user {user_id}: "
+            f"{getattr(msg.usage, 'cache_read_input_tokens', None) or 0} read, "
+            f"{getattr(msg.usage, 'cache_creation_input_tokens', None) or 0} written, "
+            f"{msg.usage.input_tokens} uncached input tokens"
+        )
+        
+        # persist only the new user-assistant pair
+        assistant_message = {
+            "role": "assistant",
+            "content": [{"type": "text", "text": assistant_response}]
+        }
+        conversation.append(assistant_message)
+        
+        log_conversation_state(conversation, "After Adding Assistant Response")
+        
+        _persist_turn(user_id, user_message, assistant_message)
+        if query_embedding is not None:
+            semantic_cache.store(context, query_embedding, assistant_response)
+        
+        logger.debug(f"Processed message for user {user_id}")
+        return assistant_response
+    except Exception as e:
+        logger.error(f"Error in get_claude_response: {e}")
+        raise
+
+class StreamingReply:
+    """Renders a streamed response into discord messages as it is generated.
+
+    The live message (initially the "Thinking" placeholder) is edited at most every
+    STREAM_EDIT_INTERVAL seconds. Once its text would exceed DISCORD_LIMIT it is finalized
+    at a natural break and the stream continues in a new message.
+    """
+
+    def __init__(self, message: Message):
+        self.channel: discord.abc.Messageable = message.channel
+        self.message: Optional[Message] = message
+        self._parts: List[str] = []
+        self._length: int = 0
+        self._streamed: bool = False
+        self._last_edit: float = 0.0
+
+    async def _render(self, text: str) -> None:
+        if not text.strip():
+            return
+        self._last_edit = time.monotonic()
+        embed = Embed(description=text, color=EMBED_COLOR)
+        if self.message is None:
+            self.message = await self.channel.send(embed=embed)
+        else:
+            await self.message.edit(content=None, embed=embed)
+
+    @property
+    def started(self) -> bool:
+        """Whether any part of the response has been rendered yet"""
+        return self._last_edit > 0.0
+
+    async def _roll_over(self) -> None:
+        """Finalize full messages until the buffered text fits in the live one"""
+        while self._length > DISCORD_LIMIT:
+            buffered = "".join(self._parts)
+            chunk = next(_split_for_discord(buffered))
+            await self._render(chunk)
+            self.message = None
+            rest = buffered[len(chunk):]
+            self._parts, self._length = [rest], len(rest)
+
+    async def feed(self, text: str) -> None:
+        self._streamed = True
+        self._parts.append(text)
+        self._length += len(text)
+        await self._roll_over()
+        if time.monotonic() - self._last_edit >= STREAM_EDIT_INTERVAL:
+            try:
+                await self._render("".join(self._parts))
+            except discord.HTTPException as e:
+                # a missed preview is fine, the next edit or finish() catches up
+                logger.warning(f"Failed to update streaming preview: {e}")
+
+    async def finish(self, full_text: str) -> None:
+        """Render whatever is still buffered; responses that weren't streamed are rendered whole"""
+        if not self._streamed:
+            self._parts, self._length = [full_text], len(full_text)
+            await self._roll_over()
+        await self._render("".join(self._parts))
+
+def _split_for_discord(text: str, limit: int = DISCORD_LIMIT) -> Iterator[str]:
+    """Yield chunks of at most `limit` chars, preferring paragraph, then line, then word breaks"""
+    start = 0
+    while len(text) - start > limit:
+        window_end = start + limit
+        for sep in ("\n\n", "\n", " "):
+            # only look in the back half of the window so chunks don't come out tiny
+            cut = text.rfind(sep, start + limit // 2, window_end)
+            if cut != -1:
+                cut += len(sep)
+                break
+        else:
+            cut = window_end
+        yield text[start:cut]
+        start = cut
+    if start < len(text):
+        yield text[start:]
+
+async def _send_embeds(channel: discord.abc.Messageable, chunks: Iterable[str], placeholder: Optional[Message] = None) -> None:
+    """Send chunks as embeds, packing as many into each message as discord allows.
+
+    The first message replaces the placeholder's content when one is given. Messages are
+    sent in order rather than concurrently so discord can't reorder them, and chunks are
+    consumed lazily so only the embeds of the message being built are held.
+    """
+    async def flush(batch: List[Embed]) -> None:
+        nonlocal placeholder
+        if placeholder is not None:
+            await placeholder.edit(content=None, embeds=batch)
+            placeholder = None
+        else:
+            await channel.send(embeds=batch)
+
+    batch: List[Embed] = []
+    batch_len = 0
+    for chunk in chunks:
+        if batch and (len(batch) == MAX_EMBEDS_PER_MSG or batch_len + len(chunk) > MAX_EMBED_CHARS_PER_MSG):
+            await flush(batch)
+            batch, batch_len = [], 0
+        batch.append(Embed(description=chunk, color=EMBED_COLOR))
+        batch_len += len(chunk)
+    if batch:
+        await flush(batch)
+
+async def send_msg(msg: Message, content: List[Dict[str, any]], user_id: int, is_rag_mode: bool) -> None:
+    if not content:
+        logger.warning('Content was empty.')
+        return
+
+    thinking_msg: Optional[Message] = None
+    reply: Optional[StreamingReply] = None
+    try:
+        thinking_msg = await msg.channel.send("Thinking 🤔...")
+        
+        # Check if user is in RAG mode
+        if is_rag_mode:
+            # Extract text from content list
+            text_content = " ".join([item["text"] for item in content if item["type"] == "text"])
+            claude_response = await rag_processor.process_query(text_content)
+            
+            if len(claude_response) <= DISCORD_LIMIT:
+                # the usual case, a single embed edited into the placeholder
+                await thinking_msg.edit(content=None, embed=Embed(description=claude_response, color=EMBED_COLOR))
+            else:
+                # split the response into chunks of DISCORD_LIMIT characters or less, the
+                # first message is edited into the placeholder instead of delete + send
+                await _send_embeds(msg.channel, _split_for_discord(claude_response), placeholder=thinking_msg)
+        else:
+            # the reply is rendered into the placeholder as it streams in, starting a new
+            # message every DISCORD_LIMIT characters
+            reply = StreamingReply(thinking_msg)
+            claude_response = await get_claude_response(user_id, msg.channel.id, content, on_text=reply.feed)
+            await reply.finish(claude_response)
+         
+        logger.debug(f"Sent response to user {user_id}")
+
+    except Exception as e:
+        logger.error(f"An error occurred in send_msg: {e}", exc_info=True)
+        error_text = "I'm sorry, I encountered an error while processing your request."
+        # reuse the placeholder unless part of the streamed reply is already shown in it
+        if thinking_msg is not None and (reply is None or not reply.started):
+            await thinking_msg.edit(content=error_text, embeds=[])
+        else:
+            await msg.channel.send(error_text)
+
+async def request_worker() -> None:
+    while True:
+        request = await request_queue.get()
+        try:
+            await send_msg(*request)
+        except Exception as e:
+            logger.error(f"Unhandled error in request worker: {e}", exc_info=True)
+        finally:
+            request_queue.task_done()
+
+@bot.event
+async def setup_hook() -> None:
+    # runs once before connecting, unlike on_ready which fires again on every reconnect
+    await storage.init()
+    # serve returning users from memory instead of hitting sqlite on their first message
+    await storage.prewarm()
+    await semantic_cache.load()
+    global rag_load_task
+    rag_load_task = asyncio.create_task(rag_processor.load())
+    request_workers.extend(asyncio.create_task(request_worker()) for _ in range(MAX_CONCURRENT_REQUESTS))
+
+@bot.event
+async def on_ready() -> None:
+    logger.info(f'{bot.user} is now running...')
+    
+    if TEST_MODE:
+        logger.info("=== RUNNING IN TEST MODE ===")
+        logger.info(f"Max Memory: {MAX_MEMORY} messages ({MAX_MEMORY//2} pairs)")
+        logger.info(f"Using test database: {storage.db_path}")
+    
+    # check if PyNaCl is installed
+    try:
+        import nacl
+        logger.info("PyNaCl is installed. Voice support is available.")
+    except ImportError:
+        logger.warning("PyNaCl is not installed. Voice will NOT be supported.")
+
+@bot.event
+async def on_message(msg: Message) -> None:
+    if msg.author.id == bot.user.id:
+        return
+
+    # most traffic on a busy server neither mentions the bot nor is a command, bail out
+    # on those before doing any other work
+    mentioned = bot.user.id in msg.raw_mentions
+    if not mentioned and msg.reference is not None:
+        # a reply with ping on mentions the bot without an <@id> in the text
+        mentioned = bot.user in msg.mentions
+    if not mentioned and not msg.content.startswith(bot.command_prefix):
+        return
+
+    if mentioned:
+        content = []
+        
+        # process text
+        if msg.content:
+            content.append({"type": "text", "text": msg.content})
+        
+        reading_msg = None
+        if msg.attachments:
+            reading_msg = await msg.channel.send("reading your attachments 🔎...")
+
+        # process attachments - pass RAG processor and mode
+        user_id = msg.author.id
+        is_rag_mode = user_id in rag_mode_users
+        # attachments are independent, so download and process them concurrently
+        attachment_contents = await asyncio.gather(*(
+            process_file(
+                attachment, 
+                user_id, 
+                storage,
+                rag_processor=rag_processor if is_rag_mode else None,
+                is_rag_mode=is_rag_mode
+            )
+            for attachment in msg.attachments
+        ), return_exceptions=True)
+        # one unreadable attachment shouldn't drop the rest of the message
+        for attachment, attachment_content in zip(msg.attachments, attachment_contents):
+            if isinstance(attachment_content, Exception):
+                logger.error(f"Error processing attachment {attachment.filename}: {attachment_content}", exc_info=attachment_content)
+            else:
+                content.extend(attachment_content)
+        
+        if reading_msg:
+            await reading_msg.delete()
+
+        if content:
+            try:
+                request_queue.put_nowait((msg, content, user_id, is_rag_mode))
+            except asyncio.QueueFull:
+                await msg.channel.send("I'm busy with other requests right now, please try again in a moment.")
+        else:
+            await msg.channel.send("Please provide some text, images, or files for me to analyze.")
+    
+    await bot.process_commands(msg)
+
+@bot.command(name='rag')
+async def toggle_rag(ctx):
+    """Toggle RAG mode for research paper queries"""
+    user_id = ctx.author.id
+    
+    if user_id in rag_mode_users:
+        rag_mode_users.remove(user_id)
+        await ctx.send("RAG mode disabled. I will now respond normally to your queries.")
+    else:
+        rag_mode_users.add(user_id)
+        await ctx.send("RAG mode enabled! I will now use research papers to answer your queries. You can:\n"
+                      "1. Ask questions about papers in the local database\n"
+                      "2. If local papers are insufficient, I'll search and analyze external papers\n"
+                      "3. Attach PDF papers to add them to the local database\n"
+                      "Use >rag again to disable RAG mode.")
+
+@bot.command(name='delete_history')
+async def delete_history(ctx):
+    user_id = ctx.author.id
+    confirm_msg = await ctx.send("Are you sure you want to delete your entire conversation history? This action cannot be undone. Reply with 'y' to confirm.")
+    
+    def check(m):
+        return m.author == ctx.author and m.channel == ctx.channel and m.content.lower() == 'y'
+    
+    try:
+        await bot.wait_for('message', check=check, timeout=30.0)
+    except asyncio.TimeoutError:
+        await confirm_msg.edit(content="Deletion cancelled. You did not confirm in time.")
+    else:
+        await storage.delete_user_convo(user_id)
+        await ctx.send("Your conversation history has been deleted.")
+
+async def main() -> None:
+    try:
+        await bot.start(DISCORD_TOK)
+    except discord.LoginFailure:
+        logger.error("Failed to log in. Please check your Discord token.")
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}")
+    finally:
+        for worker in request_workers:
+            worker.cancel()
+        if rag_load_task is not None:
+            rag_load_task.cancel()
+        await rag_processor.close()
+        if pending_writes:
+            await asyncio.gather(*pending_writes, return_exceptions=True)
+        await storage.close()
+        await claude_client.close()
+        shutdown_pdf_pool()
+
+def run() -> None:
+    try:
+        if sys.platform == 'win32':
+            asyncio.run(main())
+        else:
+            # libuv-backed event loop, faster socket I/O for the gateway, API and db calls
+            import uvloop
+            uvloop.run(main())
+    except KeyboardInterrupt:
+        logger.info("Bot stopped by user.")
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}")
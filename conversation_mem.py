@@ -1,68 +1,498 @@
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Deque, AsyncIterator
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from pathlib import Path
 import aiosqlite
-import json
+import asyncio
+import hashlib
+import orjson
+import pybase64
 import logging
 
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# max number of users whose deserialized history is kept in memory
+_MAX_CACHED_CONVOS: int = 1024
+
+# per-connection settings: WAL only needs an fsync at checkpoints under synchronous=NORMAL,
+# and the page cache (20 MB) plus mmap keep the small tables hot in memory
+_CONNECTION_PRAGMAS: Tuple[str, ...] = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-20000",
+)
+
+# max number of base64-encoded attachments kept in memory
+_MAX_CACHED_ATTACHMENTS: int = 256
+
+# read-only connections serving get_convo/get_attachment. each aiosqlite connection runs on
+# its own thread, and under WAL readers don't block the writer or each other
+_READER_COUNT: int = 4
+
+# appends arriving within this window (seconds) are committed together in one transaction
+_FLUSH_INTERVAL: float = 0.05
+
+_INSERT_MESSAGE: str = "INSERT INTO messages (user_id, seq, role, content) VALUES (?, ?, ?, ?)"
+# keeps a user's newest max_history rows, taking (user_id, user_id, max_history - 1). the
+# cutoff is found by counting rows, a failed flush leaves a gap in the user's seq numbers
+_TRIM_MESSAGES: str = (
+    "DELETE FROM messages WHERE user_id = ? AND seq < "
+    "(SELECT seq FROM messages WHERE user_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)"
+)
+
+# payloads larger than this (in bytes/chars) are (de)serialized in a worker thread so a
+# big history doesn't stall the event loop; below it the thread hop costs more than orjson
+_OFFLOAD_THRESHOLD: int = 8192
+
+def _content_size(content: any) -> int:
+    """Cheap estimate of a message's encoded size without serializing it"""
+    if isinstance(content, str):
+        return len(content)
+    return sum(len(block.get('text') or block.get('source', {}).get('data') or '') for block in content)
+
+def _as_blocks(content: any) -> List[Dict[str, any]]:
+    """Normalize message content to the list-of-blocks form the Anthropic API expects"""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return content
+
+async def _loads(blob: bytes) -> any:
+    if len(blob) > _OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(orjson.loads, blob)
+    return orjson.loads(blob)
+
+async def _dumps(content: any) -> bytes:
+    if _content_size(content) > _OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(orjson.dumps, content)
+    return orjson.dumps(content)
 
 class ConversationStorage:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, max_history: int = 20):
         self.db_path: str = db_path
+        # long-lived writer connection plus a pool of readers, opened in init()
+        self.db: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        # idle readers, handed out in FIFO order
+        self._idle_readers: asyncio.Queue = asyncio.Queue()
+        # number of most recent messages returned by get_convo; keep it even so the
+        # window always starts on a user message
+        self.max_history: int = max_history
+        # read-through LRU cache of user_id -> conversation, most recently used last. each
+        # history is a deque bounded to max_history so appends trim it for free.
+        # discord.py dispatches events on a single event loop so no locking is needed
+        self._cache: OrderedDict[int, Deque[Dict[str, any]]] = OrderedDict()
+        # LRU cache of attachment_id -> (media_type, base64 data), attachments never change
+        # once stored so entries only go away on eviction or delete_user_convo
+        self._b64_cache: OrderedDict[int, Tuple[str, str]] = OrderedDict()
+        # next seq number per user, loaded lazily from MAX(seq)
+        self._next_seq: Dict[int, int] = {}
+        # per user, the number of writes (appends, deletes) ever started and how much of them
+        # (appended rows, deletes) isn't done yet. a history read while either moves is stale
+        self._writes_started: Dict[int, int] = {}
+        self._unsettled: Dict[int, int] = {}
+        # group commit: rows waiting for the next flush and the appends waiting on it
+        self._pending: List[Tuple[int, int, str, bytes]] = []
+        self._waiters: List[asyncio.Future] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # the writer connection has one transaction at a time, so every write to it runs
+        # under this lock. otherwise a commit or rollback would take in another coroutine's
+        # half-finished statements
+        self._write_lock: asyncio.Lock = asyncio.Lock()
+
+    def _cache_put(self, user_id: int, conversation: List[Dict[str, any]]) -> None:
+        self._cache[user_id] = deque(conversation, maxlen=self.max_history)
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > _MAX_CACHED_CONVOS:
+            self._cache.popitem(last=False)
 
     async def init(self) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    user_id TEXT PRIMARY KEY,
-                    history TEXT NOT NULL
-                )
-            """)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS attachments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT,
-                    filename TEXT,
-                    content BLOB
-                )
-            """)
-            await db.commit()
+        if self.db is not None:
+            return
+        self.db = await aiosqlite.connect(self.db_path)
+        db = self.db
+        # journal mode is persistent in the db file, the rest apply to this connection
+        await db.execute("PRAGMA journal_mode=WAL")
+        for pragma in _CONNECTION_PRAGMAS:
+            await db.execute(pragma)
 
-    async def get_convo(self, user_id: str) -> List[Dict[str, any]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT history FROM conversations WHERE user_id = ?", (user_id,)) as cursor:
-                result = await cursor.fetchone()
-                if result:
-                    return json.loads(result[0])
-        return []
+        # append-only log, one row per message. the primary key index on
+        # (user_id, seq) also serves the ORDER BY seq DESC scan in get_convo.
+        # content holds the orjson-encoded bytes as-is to skip a utf-8 decode/encode
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                user_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content BLOB NOT NULL,
+                PRIMARY KEY (user_id, seq)
+            )
+        """)
+        # attachment bytes are content-addressed by sha256 so the same file sent by many
+        # users (or many times) is stored once, attachments holds the per-user references
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS attachment_blobs (
+                sha BLOB PRIMARY KEY,
+                content BLOB NOT NULL
+            )
+        """)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS attachments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                filename TEXT,
+                media_type TEXT,
+                sha BLOB
+            )
+        """)
+        await self._migrate_inline_attachments(db)
+        # lets delete_user_convo find a user's attachments without a full table scan
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_attachments_user_id ON attachments (user_id)")
+        # and check whether a blob is still referenced once they're gone
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_attachments_sha ON attachments (sha)")
+        # manifest of the local rag papers, keyed by path relative to the papers dir
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS papers (
+                file_location TEXT PRIMARY KEY,
+                doi TEXT,
+                title TEXT
+            )
+        """)
+        await self._migrate_legacy_conversations(db)
+        await self._migrate_string_content(db)
+        await db.commit()
 
-    async def update_convo(self, user_id: str, conversation: List[Dict[str, any]]) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "INSERT OR REPLACE INTO conversations (user_id, history) VALUES (?, ?)",
-                (user_id, json.dumps(conversation))
+        # readers are opened once the schema exists, mode=ro fails on a missing db file
+        reader_uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        for _ in range(_READER_COUNT):
+            reader = await aiosqlite.connect(reader_uri, uri=True)
+            for pragma in _CONNECTION_PRAGMAS:
+                await reader.execute(pragma)
+            self._readers.append(reader)
+            self._idle_readers.put_nowait(reader)
+
+    @asynccontextmanager
+    async def _transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Hold the writer for one transaction, committed on success and rolled back on error"""
+        async with self._write_lock:
+            try:
+                yield self.db
+                await self.db.commit()
+            except BaseException:
+                await self._rollback()
+                raise
+
+    async def _rollback(self) -> None:
+        try:
+            await self.db.rollback()
+        except Exception as e:
+            logger.error(f"Error rolling back: {e}")
+
+    @asynccontextmanager
+    async def _acquire_reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        reader = await self._idle_readers.get()
+        try:
+            yield reader
+        finally:
+            self._idle_readers.put_nowait(reader)
+
+    async def _migrate_legacy_conversations(self, db: aiosqlite.Connection) -> None:
+        """Move histories from the old one-blob-per-user table into the message log"""
+        async with db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'conversations'") as cursor:
+            if not await cursor.fetchone():
+                return
+
+        async with db.execute("SELECT user_id, history FROM conversations") as cursor:
+            legacy = await cursor.fetchall()
+        for user_id, history in legacy:
+            conversation = orjson.loads(history)
+            # older trimming could leave the history starting on an assistant turn
+            while conversation and conversation[0]['role'] != 'user':
+                conversation.pop(0)
+            await db.executemany(
+                "INSERT OR IGNORE INTO messages (user_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(int(user_id), seq, msg['role'], orjson.dumps(_as_blocks(msg['content']))) for seq, msg in enumerate(conversation)]
             )
-            await db.commit()
+        await db.execute("DROP TABLE conversations")
+
+    async def _migrate_inline_attachments(self, db: aiosqlite.Connection) -> None:
+        """Move attachment bytes stored inline in the attachments table into attachment_blobs"""
+        async with db.execute("PRAGMA table_info(attachments)") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if 'content' not in columns:
+            return
+        if 'media_type' not in columns:
+            await db.execute("ALTER TABLE attachments ADD COLUMN media_type TEXT")
+        if 'sha' not in columns:
+            await db.execute("ALTER TABLE attachments ADD COLUMN sha BLOB")
+
+        # one row at a time, the table can be far larger than memory
+        async with db.execute("SELECT id FROM attachments WHERE content IS NOT NULL") as cursor:
+            attachment_ids = [row[0] for row in await cursor.fetchall()]
+        for attachment_id in attachment_ids:
+            async with db.execute("SELECT content FROM attachments WHERE id = ?", (attachment_id,)) as cursor:
+                (content,) = await cursor.fetchone()
+            sha = hashlib.sha256(content).digest()
+            await db.execute("INSERT OR IGNORE INTO attachment_blobs (sha, content) VALUES (?, ?)", (sha, content))
+            await db.execute("UPDATE attachments SET sha = ? WHERE id = ?", (sha, attachment_id))
+        await db.execute("ALTER TABLE attachments DROP COLUMN content")
 
-    async def store_attachment(self, user_id: str, filename: str, content: bytes) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+    async def _migrate_string_content(self, db: aiosqlite.Connection) -> None:
+        """Rewrite rows stored with plain string content into the list-of-blocks form, once"""
+        async with db.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        if version >= 1:
+            return
+
+        # a json-encoded string starts with a double quote, block lists with a bracket
+        async with db.execute("SELECT user_id, seq, content FROM messages WHERE substr(content, 1, 1) = X'22'") as cursor:
+            rows = await cursor.fetchall()
+        await db.executemany(
+            "UPDATE messages SET content = ? WHERE user_id = ? AND seq = ?",
+            [(orjson.dumps(_as_blocks(orjson.loads(content))), user_id, seq) for user_id, seq, content in rows]
+        )
+        await db.execute("PRAGMA user_version = 1")
+
+    async def get_convo(self, user_id: int) -> List[Dict[str, any]]:
+        """Return the user's most recent messages, ready to pass to the Anthropic API"""
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            self._cache.move_to_end(user_id)
+            # shallow copy so callers appending to their list can't corrupt the cache
+            return list(cached)
+
+        # rows still buffered for this user would be missing from the read below
+        if self._pending:
+            await self.flush()
+
+        # a turn is only on disk once its batch commits, and an append may not have reserved
+        # its seq yet, so only a read with none of this user's writes in flight is cached
+        settled = user_id not in self._unsettled
+        started = self._writes_started.get(user_id)
+        async with self._acquire_reader() as reader:
+            async with reader.execute(
+                "SELECT role, content FROM messages WHERE user_id = ? ORDER BY seq DESC LIMIT ?",
+                (user_id, self.max_history)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        # content is normalized to block lists on write, so it goes to the API as loaded
+        conversation = [{"role": role, "content": await _loads(content)} for role, content in reversed(rows)]
+        # a write that started while we were reading would make this snapshot stale
+        if settled and self._writes_started.get(user_id) == started:
+            self._cache_put(user_id, conversation)
+        return conversation
+
+    async def prewarm(self, limit: int = 100) -> None:
+        """Load the histories of the most recently active users into the cache"""
+        async with self.db.execute(
+            "SELECT user_id FROM messages GROUP BY user_id ORDER BY MAX(rowid) DESC LIMIT ?",
+            (min(limit, _MAX_CACHED_CONVOS),)
+        ) as cursor:
+            user_ids = [row[0] for row in await cursor.fetchall()]
+        # least recent first so the most recent users end up at the hot end of the LRU
+        for user_id in reversed(user_ids):
+            await self.get_convo(user_id)
+
+    async def _reserve_seq(self, user_id: int, count: int) -> int:
+        """Reserve `count` consecutive seq numbers for the user and return the first"""
+        if user_id not in self._next_seq:
+            async with self.db.execute("SELECT MAX(seq) FROM messages WHERE user_id = ?", (user_id,)) as cursor:
+                result = await cursor.fetchone()
+            self._next_seq.setdefault(user_id, 0 if result[0] is None else result[0] + 1)
+        seq = self._next_seq[user_id]
+        self._next_seq[user_id] = seq + count
+        return seq
+
+    async def append_messages(self, user_id: int, items: List[Dict[str, any]]) -> None:
+        """Append new messages (e.g. a user/assistant pair) to the user's history.
+
+        Rows are buffered for up to _FLUSH_INTERVAL and written with the other appends
+        in that window as one executemany + commit. The cache is updated immediately,
+        and the call returns once the batch holding these rows has committed.
+        """
+        items = [{**msg, "content": _as_blocks(msg['content'])} for msg in items]
+        # update the cache before the first await so a read right after the caller
+        # schedules this append (e.g. as a background task) already sees the new turn
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            cached.extend(items)
+        self._writes_started[user_id] = self._writes_started.get(user_id, 0) + 1
+        self._unsettled[user_id] = self._unsettled.get(user_id, 0) + len(items)
+
+        try:
+            seq = await self._reserve_seq(user_id, len(items))
+            rows = [(user_id, seq + i, msg['role'], await _dumps(msg['content'])) for i, msg in enumerate(items)]
+        except BaseException:
+            self._settle(user_id, len(items))
+            raise
+        self._pending.extend(rows)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        await waiter
+
+    def _settle(self, user_id: int, count: int) -> None:
+        """Mark `count` of the user's writes as done, whether they committed or not"""
+        remaining = self._unsettled[user_id] - count
+        if remaining:
+            self._unsettled[user_id] = remaining
+        else:
+            del self._unsettled[user_id]
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(_FLUSH_INTERVAL)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing pending messages: {e}")
+
+    async def flush(self) -> None:
+        """Write all pending messages and trim the affected histories in a single transaction"""
+        async with self._write_lock:
+            await self._flush_locked()
+
+    async def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        waiters, self._waiters = self._waiters, []
+        # rows that fell out of the max_history window are never read again, drop them
+        # in the same transaction with one range delete per user (on the primary key)
+        next_seq: Dict[int, int] = {}
+        counts: Dict[int, int] = {}
+        for user_id, seq, _, _ in rows:
+            next_seq[user_id] = max(next_seq.get(user_id, 0), seq + 1)
+            counts[user_id] = counts.get(user_id, 0) + 1
+        trims = [(user_id, user_id, self.max_history - 1) for user_id, end in next_seq.items() if end > self.max_history]
+        try:
+            await self.db.executemany(_INSERT_MESSAGE, rows)
+            await self.db.executemany(_TRIM_MESSAGES, trims)
+            await self.db.commit()
+        except Exception as e:
+            # a partly applied batch would otherwise be committed by the next commit on
+            # this connection, after its callers were told it failed
+            await self._rollback()
+            # the cached histories already include the failed rows, reload them from disk.
+            # the seq numbers stay reserved, a gap in seq is harmless
+            for user_id, count in counts.items():
+                self._cache.pop(user_id, None)
+                self._settle(user_id, count)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            raise
+        for user_id, count in counts.items():
+            self._settle(user_id, count)
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def store_attachment(self, user_id: int, filename: str, content: bytes, media_type: Optional[str] = None) -> int:
+        # hashlib goes through openssl, which picks the SHA-NI/AVX2 code paths on its own when
+        # the cpu has them (its OPENSSL_ia32cap capability mask shows what was detected)
+        if len(content) > _OFFLOAD_THRESHOLD:
+            sha = (await asyncio.to_thread(hashlib.sha256, content)).digest()
+        else:
+            sha = hashlib.sha256(content).digest()
+        # reference first: a concurrent delete_user_convo only drops blobs nothing refers
+        # to, so it can't remove an existing blob between these two writes
+        async with self._transaction() as db:
             cursor = await db.execute(
-                "INSERT INTO attachments (user_id, filename, content) VALUES (?, ?, ?)",
-                (user_id, filename, content)
+                "INSERT INTO attachments (user_id, filename, media_type, sha) VALUES (?, ?, ?, ?)",
+                (user_id, filename, media_type, sha)
             )
-            await db.commit()
-            return cursor.lastrowid
+            await db.execute("INSERT OR IGNORE INTO attachment_blobs (sha, content) VALUES (?, ?)", (sha, content))
+        return cursor.lastrowid
 
     async def get_attachment(self, attachment_id: int) -> Tuple[str, bytes]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT filename, content FROM attachments WHERE id = ?", (attachment_id,)) as cursor:
+        async with self._acquire_reader() as reader:
+            async with reader.execute("SELECT filename, content FROM attachments JOIN attachment_blobs USING (sha) WHERE id = ?", (attachment_id,)) as cursor:
                 result = await cursor.fetchone()
                 if result:
                     return result
         return None
 
-    async def delete_user_convo(self, user_id: str) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
-            await db.execute("DELETE FROM attachments WHERE user_id = ?", (user_id,))
-            await db.commit()
+    async def upsert_paper(self, file_location: str, doi: str, title: str) -> None:
+        async with self._transaction() as db:
+            await db.execute(
+                """
+                INSERT INTO papers (file_location, doi, title) VALUES (?, ?, ?)
+                ON CONFLICT(file_location) DO UPDATE SET doi = excluded.doi, title = excluded.title
+                """,
+                (file_location, doi, title)
+            )
+
+    async def import_papers(self, papers: List[Tuple[str, str, str]]) -> None:
+        """Bulk insert (file_location, doi, title) rows, keeping any existing entries"""
+        async with self._transaction() as db:
+            await db.executemany(
+                "INSERT INTO papers (file_location, doi, title) VALUES (?, ?, ?) ON CONFLICT(file_location) DO NOTHING",
+                papers
+            )
+
+    async def get_papers(self) -> List[Tuple[str, str, str]]:
+        async with self.db.execute("SELECT file_location, doi, title FROM papers ORDER BY file_location") as cursor:
+            return await cursor.fetchall()
+
+    async def get_attachment_base64(self, attachment_id: int) -> Optional[Tuple[str, str]]:
+        """Return (media_type, base64 data) for an attachment, encoding each one only once"""
+        cached = self._b64_cache.get(attachment_id)
+        if cached is not None:
+            self._b64_cache.move_to_end(attachment_id)
+            return cached
+
+        async with self._acquire_reader() as reader:
+            async with reader.execute("SELECT media_type, content FROM attachments JOIN attachment_blobs USING (sha) WHERE id = ?", (attachment_id,)) as cursor:
+                result = await cursor.fetchone()
+        if not result:
+            return None
+        media_type, content = result
+        # rows stored before media_type was recorded fall back to the old hardcoded type
+        encoded = (media_type or "image/png", pybase64.b64encode_as_string(content))
+        self._b64_cache[attachment_id] = encoded
+        if len(self._b64_cache) > _MAX_CACHED_ATTACHMENTS:
+            self._b64_cache.popitem(last=False)
+        return encoded
+
+    async def delete_user_convo(self, user_id: int) -> None:
+        # counted as a write so a history read during the delete isn't cached, and the cached
+        # history is only dropped once the delete is done
+        self._writes_started[user_id] = self._writes_started.get(user_id, 0) + 1
+        self._unsettled[user_id] = self._unsettled.get(user_id, 0) + 1
+        try:
+            async with self._transaction() as db:
+                # make sure no buffered rows for this user get written after the delete
+                await self._flush_locked()
+                self._next_seq.pop(user_id, None)
+                await db.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+                async with db.execute("SELECT DISTINCT sha FROM attachments WHERE user_id = ?", (user_id,)) as cursor:
+                    shas = await cursor.fetchall()
+                await db.execute("DELETE FROM attachments WHERE user_id = ?", (user_id,))
+                # drop the blobs no other user still references
+                await db.executemany(
+                    "DELETE FROM attachment_blobs WHERE sha = ? AND NOT EXISTS (SELECT 1 FROM attachments WHERE sha = attachment_blobs.sha)",
+                    shas
+                )
+        finally:
+            self._cache.pop(user_id, None)
+            self._settle(user_id, 1)
+        # entries aren't tracked per user, and deletes are rare enough to just start over
+        self._b64_cache.clear()
+
+    async def close(self) -> None:
+        if self.db is not None:
+            await self.flush()
+            if self._flush_task is not None:
+                self._flush_task.cancel()
+                self._flush_task = None
+            for reader in self._readers:
+                await reader.close()
+            self._readers = []
+            self._idle_readers = asyncio.Queue()
+            await self.db.close()
+            self.db = None
@@ -1,40 +1,57 @@
 import discord
-from io import BytesIO, StringIO
-from typing import List, Dict
-import base64
-from pdfminer.high_level import extract_text_to_fp, extract_pages
-from pdfminer.layout import LAParams, LTTextContainer, LTImage
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Tuple
+import asyncio
+import multiprocessing
+import sys
+import pybase64
 
+from pdf_extract import extract_pdf_content_from_bytes
 
-def extract_text_from_pdf(pdf_file: BytesIO) -> str:
-    output_string = StringIO()
-    laparams = LAParams()
-    extract_text_to_fp(pdf_file, output_string, laparams=laparams, output_type='text', codec=None)
-    return output_string.getvalue()
+# pdfminer is pure python and holds the GIL, so PDFs are parsed in worker processes to keep
+# the event loop free. forkserver because forking the bot would copy its running threads;
+# the server preloads the parsing module so each worker starts from a warm, light process.
+# windows has no forkserver, so workers are spawned there
+_PDF_WORKERS: int = 2
+if sys.platform == 'win32':
+    _PDF_CONTEXT = multiprocessing.get_context("spawn")
+else:
+    _PDF_CONTEXT = multiprocessing.get_context("forkserver")
+    _PDF_CONTEXT.set_forkserver_preload(["pdf_extract"])
 
-def extract_images_from_pdf(pdf_file: BytesIO) -> List[str]:
-    images = []
-    for page_layout in extract_pages(pdf_file):
-        for element in page_layout:
-            if isinstance(element, LTImage):
-                try:
-                    image = Image.open(BytesIO(element.stream.get_data()))
-                    img_byte_arr = BytesIO()
-                    image.save(img_byte_arr, format='PNG')
-                    img_byte_arr = img_byte_arr.getvalue()
-                    base64_encoded = base64.b64encode(img_byte_arr).decode('utf-8')
-                    images.append(base64_encoded)
-                except Exception as e:
-                    print(f"Error processing image: {e}")
-    return images
+def _new_pdf_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=_PDF_WORKERS, mp_context=_PDF_CONTEXT)
 
-async def process_file(file: discord.Attachment, user_id: str, storage, rag_processor=None, is_rag_mode: bool = False) -> List[Dict[str, any]]:
+_PDF_POOL: ProcessPoolExecutor = _new_pdf_pool()
+
+def shutdown_pdf_pool() -> None:
+    """Stop the pdf workers, dropping any parses that haven't started"""
+    _PDF_POOL.shutdown(wait=False, cancel_futures=True)
+
+async def _extract_pdf(file_bytes: bytes) -> Tuple[str, List[str]]:
+    global _PDF_POOL
+    pool = _PDF_POOL
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, extract_pdf_content_from_bytes, file_bytes)
+    except BrokenProcessPool:
+        # a worker died (out of memory, a crash in a native image decoder) and took the pool
+        # with it. replace it once, not per failed parse, so later PDFs can still be read
+        if _PDF_POOL is pool:
+            _PDF_POOL = _new_pdf_pool()
+            pool.shutdown(wait=False)
+        raise
+
+# caps attachment downloads in flight across all messages
+_DOWNLOADS: asyncio.Semaphore = asyncio.Semaphore(8)
+
+async def process_file(file: discord.Attachment, user_id: int, storage, rag_processor=None, is_rag_mode: bool = False) -> List[Dict[str, any]]:
     content = []
-    file_bytes = await file.read()
+    async with _DOWNLOADS:
+        file_bytes = await file.read()
     
     # store the attachment and get its ID
-    attachment_id = await storage.store_attachment(user_id, file.filename, file_bytes)
+    attachment_id = await storage.store_attachment(user_id, file.filename, file_bytes, file.content_type)
     
     if file.filename.lower().endswith('.pdf'):
         # if in RAG mode, save PDF to papers directory
@@ -44,14 +61,12 @@ async def process_file(file: discord.Attachment, user_id: str, storage, rag_proc
                 content.append({"type": "text", "text": f"Added {file.filename} to the papers database."})
         
         # process PDF content as usual
-        file_io = BytesIO(file_bytes)
-        text = extract_text_from_pdf(file_io)
-        images = extract_images_from_pdf(BytesIO(file_bytes))  # create a new BytesIO object
+        text, images = await _extract_pdf(file_bytes)
         content.append({"type": "text", "text": text})
         for image in images[:20]:  # limit to 20 images due to API constraints
-            content.append({"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": image}})
+            content.append({"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": image}})
     elif file.content_type.startswith('image/'):
-        base64_encoded = base64.b64encode(file_bytes).decode('utf-8')
+        base64_encoded = pybase64.b64encode_as_string(file_bytes)
         content.append({"type": "image", "source": {"type": "base64", "media_type": file.content_type, "data": base64_encoded}})
     else:
         try:
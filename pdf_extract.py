@@ -0,0 +1,76 @@
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+import pybase64
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LAParams, LTContainer, LTImage, LTItem, LTText, LTTextBox, LTTextContainer
+from pdfminer.pdftypes import LITERALS_DCT_DECODE, LITERALS_JPX_DECODE
+from PIL import Image
+
+# runs in the pdf worker processes, so this module only imports what parsing needs
+
+# images are sent to claude as jpegs downscaled to its recommended max side, and tiny
+# ones (icons, rules, logos) are dropped since they only cost tokens
+_MAX_IMAGE_SIDE: int = 1568
+_MIN_IMAGE_SIDE: int = 64
+_JPEG_QUALITY: int = 85
+_ENCODED_IMAGE_FILTERS = (*LITERALS_DCT_DECODE, *LITERALS_JPX_DECODE)
+_RAW_IMAGE_MODES: Dict[int, str] = {1: "L", 3: "RGB", 4: "CMYK"}
+
+
+def _open_image(element: LTImage) -> Image.Image:
+    data = element.stream.get_data()
+    filters = element.stream.get_filters()
+    if filters and filters[-1][0] in _ENCODED_IMAGE_FILTERS:
+        # jpeg and jpeg 2000 streams are left encoded by pdfminer, so pillow reads them as files
+        return Image.open(BytesIO(data))
+    width, height = element.srcsize
+    channels = len(data) // (width * height) if element.bits == 8 and width and height else 0
+    if channels in _RAW_IMAGE_MODES:
+        # everything else comes out as raw decoded samples
+        return Image.frombytes(_RAW_IMAGE_MODES[channels], (width, height), data[:width * height * channels])
+    return Image.open(BytesIO(data))
+
+def _encode_image(element: LTImage) -> Optional[str]:
+    """Downscale an extracted image to a base64 encoded jpeg, or None if it's too small to keep"""
+    image = _open_image(element)
+    if min(image.size) < _MIN_IMAGE_SIDE:
+        return None
+    image = image.convert("RGB")
+    image.thumbnail((_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE), Image.Resampling.LANCZOS)
+    img_byte_arr = BytesIO()
+    image.save(img_byte_arr, format='JPEG', quality=_JPEG_QUALITY, optimize=True)
+    # encode straight from the buffer instead of copying it out with getvalue()
+    return pybase64.b64encode_as_string(img_byte_arr.getbuffer())
+
+def _collect(item: LTItem, text_parts: List[str], images: List[str]) -> None:
+    # walks the layout tree the way pdfminer's TextConverter does, so text inside figures
+    # (form xobjects) is kept, and picks up images, which pdfminer always wraps in a figure
+    if isinstance(item, LTTextContainer):
+        text_parts.append(item.get_text())
+        if isinstance(item, LTTextBox):
+            text_parts.append("\n")
+    elif isinstance(item, LTContainer):
+        for child in item:
+            _collect(child, text_parts, images)
+    elif isinstance(item, LTText):
+        text_parts.append(item.get_text())
+    elif isinstance(item, LTImage):
+        try:
+            base64_encoded = _encode_image(item)
+            if base64_encoded is not None:
+                images.append(base64_encoded)
+        except Exception as e:
+            print(f"Error processing image: {e}")
+
+def extract_pdf_content(pdf_file: BytesIO) -> Tuple[str, List[str]]:
+    """Extract the text and the base64 encoded images of a PDF in a single pass over its pages"""
+    text_parts = []
+    images = []
+    for page_layout in extract_pages(pdf_file, laparams=LAParams()):
+        _collect(page_layout, text_parts, images)
+        # page break, as in pdfminer's plain text output
+        text_parts.append("\f")
+    return "".join(text_parts), images
+
+def extract_pdf_content_from_bytes(file_bytes: bytes) -> Tuple[str, List[str]]:
+    return extract_pdf_content(BytesIO(file_bytes))
@@ -1,13 +1,18 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import os
 from pathlib import Path
 import asyncio
+import hashlib
+import pickle
+import string
 from paperqa import Settings, ask, Docs
 from paperqa.clients import DocMetadataClient, ALL_CLIENTS
 import paperscraper
 from dotenv import load_dotenv
 import csv
 
+from conversation_mem import ConversationStorage
+
 load_dotenv()
 CLAUDE_KEY: str = os.getenv('ANTHROPIC_API_KEY')
 OPENAI_KEY: str = os.getenv('OPENAI_API_KEY')
@@ -24,24 +29,156 @@ If there is insufficient context to answer the question properly, respond with e
 Context: {context}
 """
 
+# replaces punctuation in queries turned into search keywords with spaces, in a single
+# pass. spaces rather than deletion so e.g. "self-attention" doesn't become one word
+_KEYWORD_TRANS = str.maketrans(string.punctuation, " " * len(string.punctuation))
+
+# index changes from uploads are pickled at most this often (seconds), so a burst of
+# uploads rewrites the full docs cache once rather than once per paper
+_DOCS_SAVE_DELAY: float = 30.0
+
+# identical queries arriving while one is running, or up to this many seconds after it
+# finished, share its answer instead of running the whole pipeline again
+_QUERY_DEDUP_TTL: float = 5.0
+
 class RagProcessor:
-    def __init__(self, papers_dir: str = "papers"):
+    def __init__(self, storage: ConversationStorage, papers_dir: str = "papers"):
         """Initialize RAG processor with papers directory"""
+        # the paper manifest lives in the bot's sqlite db
+        self.storage = storage
         self.papers_dir = Path(papers_dir)
         self.papers_dir.mkdir(exist_ok=True)
         self.docs = Docs()
         self.metadata_client = DocMetadataClient(clients=ALL_CLIENTS)
         self.manifest_file = self.papers_dir / "manifest.csv"
+        # pickled self.docs plus the (mtime, size, docname) of each pdf it was built from,
+        # so a restart only embeds papers that are new or changed since the last run
+        self.docs_cache_file = self.papers_dir / ".docs.cache"
+        self._files: Dict[str, Tuple[int, int, str]] = {}
+        self._loaded: bool = False
+        self._load_lock: asyncio.Lock = asyncio.Lock()
+        # held while self.docs changes and while the cache is pickled from it. its texts are
+        # indexed before the lock is released, so queries never have to change the index
+        self._docs_lock: asyncio.Lock = asyncio.Lock()
+        self._save_task: Optional[asyncio.Task] = None
+        # successful metadata lookups by (title, authors), repeated papers don't re-hit the apis
+        self._metadata_cache: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+        # in-flight and just-finished process_query runs by normalized query hash
+        self._inflight: Dict[bytes, asyncio.Task] = {}
+
+    async def load(self) -> None:
+        """Load the local papers ahead of the first query"""
+        await self._ensure_loaded()
+
+    async def _ensure_loaded(self) -> None:
+        """Populate self.docs from papers_dir once, reusing the pickled index where possible"""
+        async with self._load_lock:
+            if self._loaded:
+                return
+
+            try:
+                await self._import_manifest_csv()
+            except Exception as e:
+                print(f"Error importing manifest: {e}")
+
+            if self.docs_cache_file.exists():
+                try:
+                    self.docs, self._files = await asyncio.to_thread(self._read_docs_cache)
+                except Exception as e:
+                    print(f"Error reading docs cache, rebuilding: {e}")
+                    self.docs, self._files = Docs(), {}
+
+            current = {pdf.name: pdf.stat() for pdf in self.papers_dir.glob("*.pdf")}
+            changed = False
+            # drop papers that were removed or modified since the cache was written
+            for name, (mtime, size, docname) in list(self._files.items()):
+                stat = current.get(name)
+                if stat is None or (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                    self.docs.delete(docname=docname)
+                    del self._files[name]
+                    changed = True
+
+            # and embed only the ones the cache doesn't cover
+            for name, stat in current.items():
+                if name in self._files:
+                    continue
+                try:
+                    docname = await self.docs.aadd(str(self.papers_dir / name), settings=BASE_SETTINGS)
+                except Exception as e:
+                    print(f"Error loading {name}: {e}")
+                    continue
+                if docname:
+                    self._files[name] = (stat.st_mtime_ns, stat.st_size, docname)
+                    changed = True
+
+            async with self._docs_lock:
+                # also covers caches pickled before texts were indexed up front
+                indexed = len(self.docs.texts_index)
+                await self._index_texts()
+                changed = changed or len(self.docs.texts_index) != indexed
+            if changed:
+                await self._save_docs_cache()
+            self._loaded = True
+
+    async def _index_texts(self) -> None:
+        """Add texts not yet in the vector index to it, with _docs_lock held"""
+        # paperqa does this lazily inside aquery, where it would change the index under a
+        # pickle running in another thread. done here it leaves aquery nothing to add
+        await self.docs._build_texts_index(BASE_SETTINGS.get_embedding_model())
+
+    def _read_docs_cache(self) -> Tuple[Docs, Dict[str, Tuple[int, int, str]]]:
+        with open(self.docs_cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        return cached['docs'], cached['files']
+
+    def _write_docs_cache(self, files: Dict[str, Tuple[int, int, str]]) -> None:
+        # written next to the cache and swapped in, a crash mid-write keeps the old one
+        tmp_file = self.docs_cache_file.with_suffix(".tmp")
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'docs': self.docs, 'files': files}, f)
+        os.replace(tmp_file, self.docs_cache_file)
+
+    async def _save_docs_cache(self) -> None:
+        async with self._docs_lock:
+            try:
+                # pickling the whole index is O(corpus), keep it off the event loop
+                await asyncio.to_thread(self._write_docs_cache, dict(self._files))
+            except Exception as e:
+                print(f"Error saving docs cache: {e}")
+
+    def _schedule_save(self) -> None:
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self) -> None:
+        await asyncio.sleep(_DOCS_SAVE_DELAY)
+        self._save_task = None
+        await self._save_docs_cache()
+
+    async def close(self) -> None:
+        """Write out index changes still waiting for a scheduled save"""
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+            await self._save_docs_cache()
+        else:
+            # let a save that's already writing finish
+            async with self._docs_lock:
+                pass
         
     async def get_paper_metadata(self, title: str, authors: Optional[list] = None) -> Dict[str, Any]:
         """Get high quality metadata from multiple sources"""
+        key = (title, tuple(authors or ()))
+        cached = self._metadata_cache.get(key)
+        if cached is not None:
+            return cached
         try:
             details = await self.metadata_client.query(
                 title=title,
                 authors=authors,
                 fields=["title", "doi", "citation_count", "license", "pdf_url", "formatted_citation"]
             )
-            return {
+            metadata = {
                 "citation": details.formatted_citation,
                 "citation_count": details.citation_count,
                 "license": details.license,
@@ -49,85 +186,66 @@ class RagProcessor:
                 "doi": details.doi,
                 "title": details.title
             }
+            self._metadata_cache[key] = metadata
+            return metadata
         except Exception as e:
             print(f"Error getting metadata: {e}")
             return {}
 
-    async def update_manifest(self, filename: str, metadata: Dict[str, Any]) -> None:
-        """Update the manifest CSV file with paper metadata"""
-        try:
-            # create manifest file if it doesn't exist
-            if not self.manifest_file.exists():
-                with open(self.manifest_file, 'w', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(['file_location', 'doi', 'title'])
-
-            # read existing entries
-            entries = []
-            with open(self.manifest_file, 'r', newline='') as f:
-                reader = csv.DictReader(f)
-                entries = list(reader)
-
-            # update or add new entry
-            file_location = str(Path(filename).relative_to(self.papers_dir))
-            updated = False
-            for entry in entries:
-                if entry['file_location'] == file_location:
-                    entry['doi'] = metadata.get('doi', '')
-                    entry['title'] = metadata.get('title', '')
-                    updated = True
-                    break
-
-            if not updated:
-                entries.append({
-                    'file_location': file_location,
-                    'doi': metadata.get('doi', ''),
-                    'title': metadata.get('title', '')
-                })
-
-            # Write back all entries
-            with open(self.manifest_file, 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=['file_location', 'doi', 'title'])
-                writer.writeheader()
-                writer.writerows(entries)
+    async def update_manifest(self, pdf_path: Path, metadata: Dict[str, Any]) -> None:
+        """Record paper metadata in the manifest table"""
+        file_location = str(pdf_path.relative_to(self.papers_dir))
+        await self.storage.upsert_paper(file_location, metadata.get('doi', ''), metadata.get('title', ''))
 
-        except Exception as e:
-            print(f"Error updating manifest: {e}")
+    async def _import_manifest_csv(self) -> None:
+        """One-time import of the manifest.csv used before the manifest moved to sqlite"""
+        if not self.manifest_file.exists() or await self.storage.get_papers():
+            return
+        with open(self.manifest_file, 'r', newline='') as f:
+            entries = [(row['file_location'], row['doi'], row['title']) for row in csv.DictReader(f)]
+        await self.storage.import_papers(entries)
 
-    async def extract_paper_title(self, pdf_path: str) -> str:
-        """Extract paper title from PDF using paperqa's Docs"""
-        try:
-            # create a temporary Docs instance to extract title
-            temp_docs = Docs()
-            await temp_docs.aadd(pdf_path, settings=BASE_SETTINGS)
-            # paperqa's Docs will extract the title during add
-            return temp_docs.docs[-1].docname
-        except Exception as e:
-            print(f"Error extracting title: {e}")
-            return None
+    async def export_manifest(self) -> None:
+        """Write the manifest table out as manifest.csv, e.g. for tools that still read the csv"""
+        papers = await self.storage.get_papers()
+        with open(self.manifest_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file_location', 'doi', 'title'])
+            writer.writerows(papers)
 
     async def add_paper(self, file_bytes: bytes, filename: str) -> bool:
         """Add a paper to the local papers directory"""
         try:
+            # finish the startup load first so it doesn't pick this file up a second time
+            await self._ensure_loaded()
+
             # save PDF to papers directory
             pdf_path = self.papers_dir / filename
             with open(pdf_path, 'wb') as f:
                 f.write(file_bytes)
 
-            # extract actual paper title from PDF
-            paper_title = await self.extract_paper_title(str(pdf_path))
-            if not paper_title:
-                print("Could not extract paper title")
-                return False
+            async with self._docs_lock:
+                # a re-upload under the same name replaces the earlier version
+                previous = self._files.pop(pdf_path.name, None)
+                if previous is not None:
+                    self.docs.delete(docname=previous[2])
+
+                # add to main docs instance. this parses and embeds the paper once, and the
+                # docname paperqa extracts during the add doubles as the title for metadata
+                paper_title = await self.docs.aadd(str(pdf_path), settings=BASE_SETTINGS)
+                if not paper_title:
+                    print("Could not add paper, it may already be in the database")
+                    return False
+                await self._index_texts()
+                stat = pdf_path.stat()
+                self._files[pdf_path.name] = (stat.st_mtime_ns, stat.st_size, paper_title)
+            self._schedule_save()
 
             # get metadata using the extracted title
             metadata = await self.get_paper_metadata(paper_title)
             
             # update manifest with metadata
-            await self.update_manifest(filename, metadata)
-            
-            # add to main docs instance
-            await self.docs.aadd(str(pdf_path), settings=BASE_SETTINGS)
+            await self.update_manifest(pdf_path, metadata)
             
             return True
         except Exception as e:
@@ -137,18 +255,10 @@ class RagProcessor:
     async def local_rag(self, query: str) -> Optional[str]:
         """Perform RAG using local papers database"""
         try:
-            # use the already loaded docs from add_paper
+            # papers directory is loaded once, later papers come in through add_paper
+            await self._ensure_loaded()
             if not self.docs.docs:
-                # if no papers have been added yet, try to load from papers directory
-                for pdf in self.papers_dir.glob("*.pdf"):
-                    try:
-                        await self.docs.aadd(str(pdf), settings=BASE_SETTINGS)
-                    except Exception as e:
-                        print(f"Error loading {pdf}: {e}")
-                        continue
-                
-                if not self.docs.docs:
-                    return None
+                return None
             
             # use paperqa's built-in query functionality
             answer = await self.docs.aquery(query, settings=BASE_SETTINGS)
@@ -169,7 +279,7 @@ class RagProcessor:
             # use query to generate search keywords if not provided
             if not keyword_search:
                 # Extract key terms from query
-                keyword_search = query.lower().replace("?", "").replace(".", "")
+                keyword_search = query.lower().translate(_KEYWORD_TRANS)
             
             # ssearch and download papers
             papers = await paperscraper.a_search_papers(keyword_search)
@@ -206,7 +316,26 @@ class RagProcessor:
 
     async def process_query(self, query: str) -> str:
         """Process query using local RAG first, then fall back to search if needed"""
-        
+        key = hashlib.blake2b(" ".join(query.lower().split()).encode(), digest_size=16).digest()
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._process_query(query))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._expire_query(key, done))
+        # shielded so one caller giving up doesn't cancel the run for the others
+        return await asyncio.shield(task)
+
+    def _expire_query(self, key: bytes, task: asyncio.Task) -> None:
+        def forget() -> None:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+        # failed runs are forgotten right away so the next ask retries
+        if task.cancelled() or task.exception() is not None:
+            forget()
+        else:
+            asyncio.get_running_loop().call_later(_QUERY_DEDUP_TTL, forget)
+
+    async def _process_query(self, query: str) -> str:
         # try local RAG first
         local_answer = await self.local_rag(query)
         
@@ -0,0 +1,75 @@
+from typing import List, Dict, Optional, Tuple, Deque
+from collections import deque
+import asyncio
+import hashlib
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+
+def context_key(channel_id: int, history: List[Dict[str, any]]) -> str:
+    """Channel id plus a hash of the last turn, so cached answers only match in the same channel and context"""
+    if not history:
+        return str(channel_id)
+    content = history[-1]['content']
+    if isinstance(content, str):
+        text = content
+    else:
+        text = "".join(block.get('text', '') for block in content if block.get('type') == 'text')
+    return f"{channel_id}:{hashlib.blake2b(text.encode(), digest_size=16).hexdigest()}"
+
+class SemanticCache:
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", threshold: float = 0.85, max_entries: int = 1000):
+        """Initialize cache of recent (question, response) pairs matched by embedding similarity"""
+        self.model_name: str = model_name
+        self.threshold: float = threshold
+        self._model: Optional[SentenceTransformer] = None
+        # cleared if the model can't be loaded, the bot then just runs without the cache
+        self.enabled: bool = True
+        # most recent entries last: (context key, normalized embedding, response)
+        self._entries: Deque[Tuple[str, np.ndarray, str]] = deque(maxlen=max_entries)
+
+    def _load_model(self) -> None:
+        try:
+            self._model = SentenceTransformer(self.model_name)
+        except Exception as e:
+            print(f"Error loading semantic cache model, running without the cache: {e}")
+            self.enabled = False
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        if self._model is None:
+            self._load_model()
+            if not self.enabled:
+                return None
+        # the model silently truncates longer input, which would make any two texts that only
+        # share their opening look like duplicates, so those aren't cached at all
+        if len(self._model.tokenizer.tokenize(text)) > self._model.max_seq_length - 2:
+            return None
+        return self._model.encode(text, normalize_embeddings=True)
+
+    async def load(self) -> None:
+        """Load the embedding model ahead of the first lookup"""
+        if self._model is None and self.enabled:
+            await asyncio.to_thread(self._load_model)
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        """Embedding of the query, or None if it can't be cached"""
+        if not self.enabled:
+            return None
+        # encoding is CPU-bound, keep it off the event loop
+        return await asyncio.to_thread(self._embed, text)
+
+    def lookup(self, context: str, embedding: np.ndarray) -> Optional[str]:
+        """Return the cached response for a near-duplicate query in the same context, if any"""
+        candidates = [(emb, response) for key, emb, response in self._entries if key == context]
+        if not candidates:
+            return None
+
+        # embeddings are normalized so the dot product is the cosine similarity
+        scores = np.stack([emb for emb, _ in candidates]) @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return candidates[best][1]
+        return None
+
+    def store(self, context: str, embedding: np.ndarray, response: str) -> None:
+        self._entries.append((context, embedding, response))